@@ -1,19 +1,25 @@
 # app.py
 import streamlit as st
-import uuid
-import json
+import secrets
+from collections import deque
+from contextlib import contextmanager
 from typing import Optional
 
+try:
+    import orjson  # optional: faster JSON (de)serialization
+except ImportError:
+    orjson = None
+
 st.set_page_config(page_title="Assistente de Processos (MVP)", layout="wide")
 
 # -------------------
 # Helpers / Modelo
 # -------------------
 def generate_id(prefix="n"):
-    return f"{prefix}_{uuid.uuid4().hex[:8]}"
+    return f"{prefix}_{secrets.token_hex(4)}"
 
 def init_process():
-    return {
+    process = {
         "id": generate_id("proc"),
         "name": "Novo Processo",
         "nodes": [
@@ -21,31 +27,126 @@ def init_process():
         ],
         "edges": []
     }
+    reindex_process(process)
+    return process
+
+def reindex_process(process):
+    """
+    Build the in-memory structures from the stored format: id lookups over
+    process["nodes"] and adjacency dicts replacing the process["edges"] list.
+    Keys starting with "_" are derived state; export_process() turns them
+    back into the stored format.
+    """
+    # a single pass over nodes and one over edges build every map
+    node_index, node_pos, end_id = {}, {}, None
+    for i, n in enumerate(process["nodes"]):
+        node_index[n["id"]] = n
+        node_pos[n["id"]] = i
+        if end_id is None and n["type"] == "end":
+            end_id = n["id"]
+    edges_out, edges_in = {}, {}
+    for e in process.pop("edges", []):
+        label = e.get("label")
+        edges_out.setdefault(e["from"], []).append((e["to"], label))
+        edges_in.setdefault(e["to"], []).append((e["from"], label))
+    process["_node_index"] = node_index
+    process["_node_pos"] = node_pos
+    process["_edges_out"] = edges_out
+    process["_edges_in"] = edges_in
+    process["_end_id"] = end_id
+    process["_rev"] = 0
+    process["_cache"] = {}
+
+def touch_process(process):
+    # every mutation bumps the revision and drops renders cached for the old one
+    if process.get("_batch"):
+        return  # batch_edit() bumps once when the batch ends
+    process["_rev"] = process.get("_rev", 0) + 1
+    process["_cache"] = {}
+
+@contextmanager
+def batch_edit(process):
+    """
+    Group several mutations so they bump the revision (and invalidate the
+    cached renders) once, at the end.
+    """
+    process["_batch"] = process.get("_batch", 0) + 1
+    try:
+        yield process
+    finally:
+        process["_batch"] -= 1
+        if not process["_batch"]:
+            touch_process(process)
+
+def cached(process, key, build):
+    """
+    Return build(process), computed at most once per process revision.
+    """
+    cache = process.setdefault("_cache", {})
+    if key not in cache:
+        cache[key] = build(process)
+    return cache[key]
+
+def export_process(process):
+    # drop derived ("_"-prefixed) keys and restore the legacy edge list
+    data = {k: v for k, v in process.items() if not k.startswith("_")}
+    data["edges"] = [{"from": f, "to": t, "label": l} for f, t, l in iter_edges(process)]
+    return data
+
+def process_json_bytes(process):
+    data = export_process(process)
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    import json
+    return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+def iter_edges(process):
+    # yields (from_id, to_id, label), grouped by source node
+    for from_id, outs in process["_edges_out"].items():
+        for to_id, label in outs:
+            yield from_id, to_id, label
+
+def _first_end_id(process):
+    return next((n["id"] for n in process["nodes"] if n["type"] == "end"), None)
 
 def find_node(process, node_id):
-    for n in process["nodes"]:
-        if n["id"] == node_id:
-            return n
-    return None
+    return process["_node_index"].get(node_id)
 
 def get_node_index(process, node_id) -> Optional[int]:
-    for i, n in enumerate(process["nodes"]):
-        if n["id"] == node_id:
-            return i
-    return None
+    return process["_node_pos"].get(node_id)
+
+def _append_node(process, node):
+    process["nodes"].append(node)
+    process["_node_index"][node["id"]] = node
+    process["_node_pos"][node["id"]] = len(process["nodes"]) - 1
+    if node["type"] == "end" and process["_end_id"] is None:
+        process["_end_id"] = node["id"]
+    touch_process(process)
 
 def add_node(process, label, ntype="task"):
     nid = generate_id("n")
-    process["nodes"].append({"id": nid, "label": label, "type": ntype})
+    _append_node(process, {"id": nid, "label": label, "type": ntype})
     return nid
 
 def add_edge(process, from_id, to_id, label=None):
-    process["edges"].append({"from": from_id, "to": to_id, "label": label})
+    process["_edges_out"].setdefault(from_id, []).append((to_id, label))
+    process["_edges_in"].setdefault(to_id, []).append((from_id, label))
+    touch_process(process)
+
+def remove_edge(process, from_id, to_id, label=None):
+    # Remove one from_id -> to_id edge, in O(degree)
+    outs = process["_edges_out"].get(from_id, [])
+    if (to_id, label) not in outs:
+        return
+    outs.remove((to_id, label))
+    process["_edges_in"][to_id].remove((from_id, label))
+    touch_process(process)
 
 def update_node_label(process, node_id, new_label):
     node = find_node(process, node_id)
     if node:
         node["label"] = new_label
+        touch_process(process)
 
 def delete_nodes_after(process, node_id):
     """
@@ -60,47 +161,107 @@ def delete_nodes_after(process, node_id):
     removed = process["nodes"][idx + 1 :]
     removed_ids = {n["id"] for n in removed}
     process["nodes"] = keep
+    for nid in removed_ids:
+        process["_node_index"].pop(nid, None)
+        process["_node_pos"].pop(nid, None)
     # Remove edges that reference removed nodes
-    process["edges"] = [e for e in process["edges"] if e["from"] not in removed_ids and e["to"] not in removed_ids]
+    for nid in removed_ids:
+        _drop_edges(process, nid)
+    if process["_end_id"] in removed_ids:
+        process["_end_id"] = _first_end_id(process)
+    touch_process(process)
+
+def _drop_edges(process, node_id):
+    # Remove every edge touching node_id, in O(degree)
+    edges_out, edges_in = process["_edges_out"], process["_edges_in"]
+    for to_id, _ in edges_out.pop(node_id, []):
+        edges_in[to_id] = [x for x in edges_in.get(to_id, []) if x[0] != node_id]
+    for from_id, _ in edges_in.pop(node_id, []):
+        edges_out[from_id] = [x for x in edges_out.get(from_id, []) if x[0] != node_id]
 
 def remove_node(process, node_id):
     # Remove a single node and its edges
     process["nodes"] = [n for n in process["nodes"] if n["id"] != node_id]
-    process["edges"] = [e for e in process["edges"] if e["from"] != node_id and e["to"] != node_id]
+    process["_node_index"].pop(node_id, None)
+    # positions after the removed node shift, so rebuild them
+    process["_node_pos"] = {n["id"]: i for i, n in enumerate(process["nodes"])}
+    _drop_edges(process, node_id)
+    if process["_end_id"] == node_id:
+        process["_end_id"] = _first_end_id(process)
+    touch_process(process)
 
 def ensure_end_node(process):
-    end_nodes = [n for n in process["nodes"] if n["type"] == "end"]
-    if end_nodes:
-        return end_nodes[0]["id"]
+    if process["_end_id"] is not None:
+        return process["_end_id"]
     # create end node
     end_id = "end"
     # if id in use, create unique
     if find_node(process, end_id):
         end_id = add_node(process, "Fim", ntype="end")
     else:
-        process["nodes"].append({"id": end_id, "label": "Fim", "type": "end"})
+        _append_node(process, {"id": end_id, "label": "Fim", "type": "end"})
     return end_id
 
+# Mermaid node shape per node type ({i}: id, {l}: label)
+_NODE_FMT = {
+    "start": "    {i}([{l}])",
+    "end": "    {i}([{l}])",
+    "task": "    {i}[{l}]",
+    "decision": "    {i}{{{l}}}",
+}
+_NODE_FMT_DEFAULT = "    {i}[{l}]"
+# characters that would break mermaid node/edge syntax inside a label;
+# mermaid entity codes keep them visible in the rendered diagram
+_MERMAID_TRANS = str.maketrans({
+    "\n": " ", "\r": " ",
+    "|": "#124;", "[": "#91;", "]": "#93;", "{": "#123;", "}": "#125;",
+    "(": "#40;", ")": "#41;", '"': "#quot;",
+})
+
 def generate_mermaid(process):
-    lines = ["flowchart TD"]
-    # nodes
-    for n in process["nodes"]:
-        safe_label = n["label"].replace("\n", " ")
-        if n["type"] in ("start", "end"):
-            lines.append(f'    {n["id"]}([{safe_label}])')
-        elif n["type"] == "task":
-            lines.append(f'    {n["id"]}[{safe_label}]')
-        elif n["type"] == "decision":
-            lines.append(f'    {n["id"]}{{{safe_label}}}')
-        else:
-            lines.append(f'    {n["id"]}[{safe_label}]')
-    # edges
-    for e in process["edges"]:
-        if e.get("label"):
-            lines.append(f'    {e["from"]} -->|{e["label"]}| {e["to"]}')
-        else:
-            lines.append(f'    {e["from"]} --> {e["to"]}')
-    return "\n".join(lines)
+    node_lines = [
+        _NODE_FMT.get(n["type"], _NODE_FMT_DEFAULT).format(i=n["id"], l=n["label"].translate(_MERMAID_TRANS))
+        for n in process["nodes"]
+    ]
+    edge_lines = [
+        f'    {f} -->|{l.translate(_MERMAID_TRANS)}| {t}' if l else f'    {f} --> {t}'
+        for f, t, l in iter_edges(process)
+    ]
+    return "\n".join(["flowchart TD", *node_lines, *edge_lines])
+
+@st.cache_data
+def render_mermaid_html(code):
+    # standalone page for the components iframe; only the mermaid code varies
+    return f"""
+    <!doctype html>
+    <html>
+    <head>
+      <meta charset="utf-8">
+      <script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
+      <style> body {{ margin: 0; padding: 0; }} </style>
+    </head>
+    <body>
+      <div class="mermaid">
+{code}
+      </div>
+      <script> mermaid.initialize({{startOnLoad:true}}); </script>
+    </body>
+    </html>
+    """
+
+def node_options(process):
+    """
+    Selectbox options for the action panel, built in one pass: the node ids
+    plus id -> "label (type)" (parent pickers) and id -> "idx — label (type)"
+    (step pickers) maps for format_func.
+    """
+    ids, parent_text, step_text = [], {}, {}
+    for idx, n in enumerate(process["nodes"]):
+        text = f'{n["label"]} ({n["type"]})'
+        ids.append(n["id"])
+        parent_text[n["id"]] = text
+        step_text[n["id"]] = f"{idx} — {text}"
+    return ids, parent_text, step_text
 
 def last_non_start_node(process):
     # return the last node that is not the start, else start
@@ -112,10 +273,13 @@ def last_non_start_node(process):
 # -------------------
 # Session state init
 # -------------------
+# older messages are dropped so the chat re-render stays bounded
+CONVERSATION_MAXLEN = 200
+
 if "process" not in st.session_state:
     st.session_state.process = init_process()
 if "conversation" not in st.session_state:
-    st.session_state.conversation = []  # list of dicts {role, text}
+    st.session_state.conversation = deque(maxlen=CONVERSATION_MAXLEN)  # dicts {role, text}
 if "expecting" not in st.session_state:
     # expecting: None or one of: "process_name", "first_activity", "next_action"
     st.session_state.expecting = "process_name"
@@ -139,6 +303,166 @@ if not st.session_state.conversation:
     assistant_say("Qual o nome do processo?")
     st.session_state.expecting = "process_name"
 
+# -------------------
+# Callbacks
+# -------------------
+# Buttons mutate the process through on_click callbacks: Streamlit runs them
+# before the rerun, so the whole page (diagram included) renders the new
+# state in that single run. Feedback is queued with notify() and shown on
+# the rerun by show_notice().
+def notify(slot, kind, text):
+    st.session_state.notice = (slot, kind, text)
+
+def show_notice(slot):
+    notice = st.session_state.get("notice")
+    if notice and notice[0] == slot:
+        del st.session_state.notice
+        getattr(st, notice[1])(notice[2])
+
+def reset_process_cb():
+    st.session_state.process = init_process()
+    st.session_state.conversation = deque(maxlen=CONVERSATION_MAXLEN)
+    st.session_state.expecting = "process_name"
+    st.session_state.last_added_node = None
+    assistant_say("Processo reiniciado.")
+    assistant_say("Qual o nome do processo?")
+
+def edit_node_cb(node_id):
+    process = st.session_state.process
+    # check if node is last
+    if get_node_index(process, node_id) != len(process["nodes"]) - 1:
+        notify("nodes", "warning", "Para editar este passo você precisa primeiro apagar os passos posteriores. Use 'Deletar até aqui' no chat à direita.")
+    else:
+        # show a small modal-like inline edit (use st.session_state temporary storage)
+        st.session_state._editing_node = node_id
+
+def delete_node_cb(node_id):
+    process = st.session_state.process
+    node = find_node(process, node_id)
+    # check must not delete start
+    if node["type"] == "start":
+        notify("nodes", "error", "Não é possível deletar o nó inicial.")
+    else:
+        i = get_node_index(process, node_id)
+        remove_node(process, node_id)
+        notify("nodes", "success", f"Nó '{node['label']}' removido.")
+        # record in conversation
+        user_say(f"Deletei o passo {i} ({node['label']}).")
+
+def delete_edge_cb(from_id, to_id, label):
+    # edges are addressed by content, not list position, so a stale button
+    # can never remove a different edge
+    process = st.session_state.process
+    remove_edge(process, from_id, to_id, label)
+    from_node, to_node = find_node(process, from_id), find_node(process, to_id)
+    from_label = from_node["label"] if from_node else from_id
+    to_label = to_node["label"] if to_node else to_id
+    notify("edges", "success", f"Ligação '{from_label} → {to_label}' removida.")
+    user_say(f"Removi a ligação {from_label} → {to_label}.")
+
+def add_task_cb():
+    process = st.session_state.process
+    task_label = st.session_state.task_label
+    if not task_label.strip():
+        notify("actions", "warning", "Digite um rótulo para a tarefa.")
+        return
+    parent_id = st.session_state.task_parent
+    with batch_edit(process):
+        nid = add_node(process, task_label.strip(), ntype="task")
+        add_edge(process, parent_id, nid)
+    notify("actions", "success", f"Tarefa '{task_label}' adicionada após '{find_node(process,parent_id)['label']}'.")
+    user_say(f"Adicionar tarefa: {task_label} (após {find_node(process,parent_id)['label']})")
+    st.session_state.last_added_node = nid
+    # let the picker fall back to its default (the new last node)
+    del st.session_state.task_parent
+
+def add_decision_cb():
+    process = st.session_state.process
+    dec_label = st.session_state.dec_label
+    yes_label = st.session_state.yes_label
+    no_label = st.session_state.no_label
+    if not dec_label.strip():
+        notify("actions", "warning", "A decisão precisa de um rótulo.")
+        return
+    parent_id = st.session_state.dec_parent
+    with batch_edit(process):
+        dec_id = add_node(process, dec_label.strip(), ntype="decision")
+        add_edge(process, parent_id, dec_id)
+        yes_id = add_node(process, yes_label.strip() or "Sim path", ntype="task")
+        no_id = add_node(process, no_label.strip() or "Não path", ntype="task")
+        add_edge(process, dec_id, yes_id, label="Sim")
+        add_edge(process, dec_id, no_id, label="Não")
+    notify("actions", "success", "Decisão adicionada com dois ramos (Sim/Não).")
+    user_say(f"Adicionar decisão: {dec_label} (Sim->{yes_label} / Não->{no_label})")
+    st.session_state.last_added_node = dec_id
+    del st.session_state.dec_parent
+
+def add_end_cb():
+    process = st.session_state.process
+    parent_id = st.session_state.end_parent
+    with batch_edit(process):
+        end_id = ensure_end_node(process)
+        add_edge(process, parent_id, end_id)
+    notify("actions", "success", "Caminho encerrado (vinculado ao Fim).")
+    user_say(f"Encerrar processo após {find_node(process,parent_id)['label']}")
+    del st.session_state.end_parent
+
+def save_edit_cb():
+    process = st.session_state.process
+    sel_id = st.session_state.edit_sel
+    sel_idx = get_node_index(process, sel_id)
+    new_label = st.session_state.edit_input
+    # check if it's last node
+    if sel_idx != len(process["nodes"]) - 1:
+        notify("actions", "error", "Para editar este passo você precisa primeiro apagar os passos posteriores (use 'Deletar até um passo').")
+    else:
+        update_node_label(process, sel_id, new_label.strip() or find_node(process, sel_id)["label"])
+        notify("actions", "success", "Rótulo atualizado.")
+        user_say(f"Editei passo {sel_idx} -> {new_label.strip()}")
+
+def delete_after_cb():
+    process = st.session_state.process
+    sel_id = st.session_state.keep_sel
+    sel_idx = get_node_index(process, sel_id)
+    if sel_idx == len(process["nodes"]) - 1:
+        notify("actions", "info", "Não há passos posteriores para deletar.")
+    else:
+        delete_nodes_after(process, sel_id)
+        notify("actions", "success", "Passos posteriores removidos.")
+        user_say(f"Deletei passos após {sel_idx} ({find_node(process, sel_id)['label']})")
+        st.session_state.last_added_node = sel_id
+
+def upload_process_cb():
+    # runs once per new file, not on every rerun while the file stays attached
+    uploaded = st.session_state.upload_proc
+    if uploaded is None:
+        return
+    try:
+        raw = uploaded.getvalue()
+        if orjson is not None:
+            content = orjson.loads(raw)
+        else:
+            import json
+            content = json.loads(raw)
+        if isinstance(content, dict) and "nodes" in content and "edges" in content:
+            reindex_process(content)
+            st.session_state.process = content
+            notify("actions", "success", "Processo carregado.")
+            user_say("Carreguei um processo via upload.")
+        else:
+            notify("actions", "error", "JSON inválido: precisa conter 'nodes' e 'edges'.")
+    except Exception as e:
+        notify("actions", "error", f"Erro ao ler arquivo: {e}")
+
+def send_note_cb():
+    note = st.session_state.note_input
+    if note.strip():
+        user_say(note.strip())
+        assistant_say("Anotação registrada. O que deseja fazer a seguir?")
+        notify("notes", "success", "Anotação adicionada ao histórico.")
+    else:
+        notify("notes", "warning", "Escreva algo antes de enviar.")
+
 # -------------------
 # Layout
 # -------------------
@@ -151,49 +475,36 @@ with col_left:
     # Top controls: nome do processo e ações gerais
     st.subheader("Visão geral")
     nome = st.text_input("Nome do processo", value=process.get("name", "Novo Processo"))
+    # reruns with an unchanged name must not bump the revision
     if nome != process.get("name"):
         process["name"] = nome
+        touch_process(process)
+
+    # generated once per revision, shared by the export button and the preview
+    mermaid_code = cached(process, "mermaid", generate_mermaid)
 
     c1, c2, c3 = st.columns([1,1,1])
     with c1:
         if st.button("Salvar JSON (download)"):
-            st.download_button("Clique para baixar JSON", data=json.dumps(process, indent=2, ensure_ascii=False), file_name=f"{process.get('name','process')}.json", mime="application/json")
+            st.download_button("Clique para baixar JSON", data=cached(process, "json", process_json_bytes), file_name=f"{process.get('name','process')}.json", mime="application/json")
     with c2:
         if st.button("Exportar Mermaid (mostrar)"):
             st.info("Copie o texto Mermaid abaixo e cole em mermaid.live ou outro renderizador.")
-            st.code(generate_mermaid(process), language="mermaid")
+            st.code(mermaid_code, language="mermaid")
     with c3:
-        if st.button("Resetar processo"):
-            st.session_state.process = init_process()
-            st.session_state.conversation = []
-            st.session_state.expecting = "process_name"
-            st.session_state.last_added_node = None
-            assistant_say("Processo reiniciado.")
-            assistant_say("Qual o nome do processo?")
+        st.button("Resetar processo", on_click=reset_process_cb)
 
     st.markdown("---")
 
     # Diagram
     st.subheader("Diagrama (pré-visualização)")
-    mermaid_code = generate_mermaid(process)
     st.code(mermaid_code, language="mermaid")
 
-    mermaid_html = f"""
-    <!doctype html>
-    <html>
-    <head>
-      <meta charset="utf-8">
-      <script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
-      <style> body {{ margin: 0; padding: 0; }} </style>
-    </head>
-    <body>
-      <div class="mermaid">
-{mermaid_code}
-      </div>
-      <script> mermaid.initialize({{startOnLoad:true}}); </script>
-    </body>
-    </html>
-    """
+    # While the revision is unchanged reuse the same page string: the frontend
+    # keeps the iframe for an identical payload, and this skips hashing the
+    # code for the st.cache_data lookup. (Not calling html() at all would
+    # unmount the diagram rather than keep it.)
+    mermaid_html = cached(process, "mermaid_html", lambda p: render_mermaid_html(mermaid_code))
     st.components.v1.html(mermaid_html, height=520, scrolling=True)
 
     st.markdown("---")
@@ -208,32 +519,26 @@ with col_left:
             st.write(f"**{node['label']}** — _{node['type']}_")
         with cols[2]:
             # Edit action: allowed only if node is last or you delete posterior steps first
-            if st.button(f"Editar {i}", key=f"edit_{node['id']}"):
-                # check if node is last
-                if i != len(process["nodes"]) - 1:
-                    st.warning("Para editar este passo você precisa primeiro apagar os passos posteriores. Use 'Deletar até aqui' no chat à direita.")
-                else:
-                    # show a small modal-like inline edit (use st.session_state temporary storage)
-                    st.session_state._editing_node = node["id"]
-            if st.button(f"Deletar {i}", key=f"delnode_{node['id']}"):
-                # check must not delete start
-                if node["type"] == "start":
-                    st.error("Não é possível deletar o nó inicial.")
-                else:
-                    remove_node(process, node["id"])
-                    st.success(f"Nó '{node['label']}' removido.")
-                    # record in conversation
-                    user_say(f"Deletei o passo {i} ({node['label']}).")
+            st.button(f"Editar {i}", key=f"edit_{node['id']}", on_click=edit_node_cb, args=(node["id"],))
+            st.button(f"Deletar {i}", key=f"delnode_{node['id']}", on_click=delete_node_cb, args=(node["id"],))
+    show_notice("nodes")
 
     st.markdown("---")
     st.subheader("Arestas")
-    if process["edges"]:
-        for idx, e in enumerate(process["edges"]):
-            from_label = find_node(process, e["from"])["label"] if find_node(process, e["from"]) else e["from"]
-            to_label = find_node(process, e["to"])["label"] if find_node(process, e["to"]) else e["to"]
-            st.write(f"- {from_label} → {to_label}" + (f" (rótulo: {e['label']})" if e.get("label") else ""))
+    edges = list(iter_edges(process))
+    if edges:
+        id2label = {nid: n["label"] for nid, n in process["_node_index"].items()}
+        for idx, (from_id, to_id, label) in enumerate(edges):
+            from_label = id2label.get(from_id, from_id)
+            to_label = id2label.get(to_id, to_id)
+            cols = st.columns([2.7, 0.6])
+            with cols[0]:
+                st.write(f"- {from_label} → {to_label}" + (f" (rótulo: {label})" if label else ""))
+            with cols[1]:
+                st.button("Remover", key=f"deledge_{idx}_{from_id}_{to_id}", on_click=delete_edge_cb, args=(from_id, to_id, label))
     else:
         st.write("_Sem arestas ainda_.")
+    show_notice("edges")
 
 with col_right:
     # Chat-like box
@@ -255,16 +560,22 @@ with col_right:
     chat_container = st.container()
     with chat_container:
         st.write("", unsafe_allow_html=True)
-        st.markdown('<div class="chat-box">', unsafe_allow_html=True)
-        for m in st.session_state.conversation:
-            if m["role"] == "assistant":
-                st.markdown(f'<div class="msg-assistant"><strong>Assistente:</strong><div>{m["text"]}</div></div>', unsafe_allow_html=True)
-            else:
-                st.markdown(f'<div class="msg-user"><strong>Você:</strong><div>{m["text"]}</div></div>', unsafe_allow_html=True)
-        st.markdown("</div>", unsafe_allow_html=True)
+        # one element for the whole log (this also keeps the messages inside .chat-box)
+        html_parts = ['<div class="chat-box">']
+        html_parts.extend(
+            f'<div class="msg-assistant"><strong>Assistente:</strong><div>{m["text"]}</div></div>'
+            if m["role"] == "assistant" else
+            f'<div class="msg-user"><strong>Você:</strong><div>{m["text"]}</div></div>'
+            for m in st.session_state.conversation
+        )
+        html_parts.append("</div>")
+        st.markdown("".join(html_parts), unsafe_allow_html=True)
 
     st.markdown("---")
     st.markdown("**Ações rápidas**")
+    # shared by every selectbox below; rebuilt only when the process changes
+    node_ids, parent_text, step_text = cached(process, "node_options", node_options)
+
     # Action selector
     action = st.selectbox("Escolha uma ação", options=[
         "Adicionar tarefa",
@@ -279,113 +590,50 @@ with col_right:
     # Handle each action with dynamic inputs
     if action == "Adicionar tarefa":
         st.markdown("Adiciona uma tarefa **após** o nó selecionado (por padrão o último).")
-        parent_options = [(n["id"], f'{n["label"]} ({n["type"]})') for n in process["nodes"]]
-        parent_sel = st.selectbox("Anexar após:", options=parent_options, format_func=lambda x: x[1], index=len(parent_options)-1)
-        task_label = st.text_input("Rótulo da tarefa", key="task_label")
-        if st.button("Adicionar tarefa"):
-            if not task_label.strip():
-                st.warning("Digite um rótulo para a tarefa.")
-            else:
-                parent_id = parent_sel[0]
-                nid = add_node(process, task_label.strip(), ntype="task")
-                add_edge(process, parent_id, nid)
-                st.success(f"Tarefa '{task_label}' adicionada após '{find_node(process,parent_id)['label']}'.")
-                user_say(f"Adicionar tarefa: {task_label} (após {find_node(process,parent_id)['label']})")
-                st.session_state.last_added_node = nid
+        st.selectbox("Anexar após:", options=node_ids, format_func=lambda x: parent_text[x], index=len(node_ids)-1, key="task_parent")
+        st.text_input("Rótulo da tarefa", key="task_label")
+        st.button("Adicionar tarefa", on_click=add_task_cb)
 
     elif action == "Adicionar decisão (Sim/Não)":
         st.markdown("Cria um nó de decisão e dois ramos (Sim / Não). Você pode editar ou estender os ramos depois.")
-        parent_options = [(n["id"], f'{n["label"]} ({n["type"]})') for n in process["nodes"]]
-        parent_sel = st.selectbox("Anexar decisão após:", options=parent_options, format_func=lambda x: x[1], index=len(parent_options)-1, key="dec_parent")
-        dec_label = st.text_input("Texto da decisão (ex: Documentos corretos?)", key="dec_label")
-        yes_label = st.text_input("Rótulo para caminho 'Sim' (atividade)", key="yes_label", value="Aprovado")
-        no_label = st.text_input("Rótulo para caminho 'Não' (atividade)", key="no_label", value="Rejeitado")
-        if st.button("Adicionar decisão"):
-            if not dec_label.strip():
-                st.warning("A decisão precisa de um rótulo.")
-            else:
-                parent_id = parent_sel[0]
-                dec_id = add_node(process, dec_label.strip(), ntype="decision")
-                add_edge(process, parent_id, dec_id)
-                yes_id = add_node(process, yes_label.strip() or "Sim path", ntype="task")
-                no_id = add_node(process, no_label.strip() or "Não path", ntype="task")
-                add_edge(process, dec_id, yes_id, label="Sim")
-                add_edge(process, dec_id, no_id, label="Não")
-                st.success("Decisão adicionada com dois ramos (Sim/Não).")
-                user_say(f"Adicionar decisão: {dec_label} (Sim->{yes_label} / Não->{no_label})")
-                st.session_state.last_added_node = dec_id
+        st.selectbox("Anexar decisão após:", options=node_ids, format_func=lambda x: parent_text[x], index=len(node_ids)-1, key="dec_parent")
+        st.text_input("Texto da decisão (ex: Documentos corretos?)", key="dec_label")
+        st.text_input("Rótulo para caminho 'Sim' (atividade)", key="yes_label", value="Aprovado")
+        st.text_input("Rótulo para caminho 'Não' (atividade)", key="no_label", value="Rejeitado")
+        st.button("Adicionar decisão", on_click=add_decision_cb)
 
     elif action == "Encerrar processo":
         st.markdown("Anexa um nó 'Fim' após o nó escolhido.")
-        parent_options = [(n["id"], f'{n["label"]} ({n["type"]})') for n in process["nodes"]]
-        parent_sel = st.selectbox("Anexar fim após:", options=parent_options, format_func=lambda x: x[1], index=len(parent_options)-1, key="end_parent")
-        if st.button("Adicionar Fim"):
-            parent_id = parent_sel[0]
-            end_id = ensure_end_node(process)
-            add_edge(process, parent_id, end_id)
-            st.success("Caminho encerrado (vinculado ao Fim).")
-            user_say(f"Encerrar processo após {find_node(process,parent_id)['label']}")
+        st.selectbox("Anexar fim após:", options=node_ids, format_func=lambda x: parent_text[x], index=len(node_ids)-1, key="end_parent")
+        st.button("Adicionar Fim", on_click=add_end_cb)
 
     elif action == "Editar passo (regras de exclusão aplicam)":
         st.markdown("Você só pode editar um passo se ele for o último; caso contrário, apague os passos posteriores primeiro.")
-        node_options = [(n["id"], f'{idx} — {n["label"]} ({n["type"]})') for idx, n in enumerate(process["nodes"])]
-        sel = st.selectbox("Selecione o passo a editar", options=node_options, format_func=lambda x: x[1])
-        sel_id = sel[0]
+        sel_id = st.selectbox("Selecione o passo a editar", options=node_ids, format_func=lambda x: step_text[x], key="edit_sel")
         sel_idx = get_node_index(process, sel_id)
         st.write(f"Selecionado: índice {sel_idx} — {find_node(process, sel_id)['label']}")
-        new_label = st.text_input("Novo rótulo", value=find_node(process, sel_id)["label"], key="edit_input")
-        if st.button("Salvar edição"):
-            # check if it's last node
-            if sel_idx != len(process["nodes"]) - 1:
-                st.error("Para editar este passo você precisa primeiro apagar os passos posteriores (use 'Deletar até um passo').")
-            else:
-                update_node_label(process, sel_id, new_label.strip() or find_node(process, sel_id)["label"])
-                st.success("Rótulo atualizado.")
-                user_say(f"Editei passo {sel_idx} -> {new_label.strip()}")
+        st.text_input("Novo rótulo", value=find_node(process, sel_id)["label"], key="edit_input")
+        st.button("Salvar edição", on_click=save_edit_cb)
 
     elif action == "Deletar até um passo (manter este e remover posteriores)":
         st.markdown("Escolha um passo que deseja manter; todos os passos posteriores serão apagados.")
-        node_options = [(n["id"], f'{idx} — {n["label"]} ({n["type"]})') for idx, n in enumerate(process["nodes"])]
-        sel = st.selectbox("Manter passo (os posteriores serão removidos):", options=node_options, format_func=lambda x: x[1])
-        sel_id = sel[0]
+        sel_id = st.selectbox("Manter passo (os posteriores serão removidos):", options=node_ids, format_func=lambda x: step_text[x], key="keep_sel")
         sel_idx = get_node_index(process, sel_id)
         st.write(f"Irá manter o passo {sel_idx} — {find_node(process, sel_id)['label']}")
-        if st.button("Deletar posteriores"):
-            if sel_idx == len(process["nodes"]) - 1:
-                st.info("Não há passos posteriores para deletar.")
-            else:
-                delete_nodes_after(process, sel_id)
-                st.success("Passos posteriores removidos.")
-                user_say(f"Deletei passos após {sel_idx} ({find_node(process, sel_id)['label']})")
-                st.session_state.last_added_node = sel_id
+        st.button("Deletar posteriores", on_click=delete_after_cb)
 
     elif action == "Carregar processo (JSON)":
-        uploaded = st.file_uploader("Envie um JSON de processo (formato do app)", type=["json"], key="upload_proc")
-        if uploaded:
-            try:
-                content = json.load(uploaded)
-                if "nodes" in content and "edges" in content:
-                    st.session_state.process = content
-                    st.success("Processo carregado.")
-                    user_say("Carreguei um processo via upload.")
-                else:
-                    st.error("JSON inválido: precisa conter 'nodes' e 'edges'.")
-            except Exception as e:
-                st.error(f"Erro ao ler arquivo: {e}")
+        st.file_uploader("Envie um JSON de processo (formato do app)", type=["json"], key="upload_proc", on_change=upload_process_cb)
 
     else:
         st.write("_Escolha uma ação para avançar_")
+    show_notice("actions")
 
     st.markdown("---")
     st.markdown("**Mensagens / Anotações rápidas**")
-    note = st.text_input("Escreva algo (ex.: notas, comentários) e clique em 'Enviar' para registrar no chat.", key="note_input")
-    if st.button("Enviar anotação"):
-        if note.strip():
-            user_say(note.strip())
-            assistant_say("Anotação registrada. O que deseja fazer a seguir?")
-            st.success("Anotação adicionada ao histórico.")
-        else:
-            st.warning("Escreva algo antes de enviar.")
+    st.text_input("Escreva algo (ex.: notas, comentários) e clique em 'Enviar' para registrar no chat.", key="note_input")
+    st.button("Enviar anotação", on_click=send_note_cb)
+    show_notice("notes")
 
 # Footer / dicas
 st.markdown("---")